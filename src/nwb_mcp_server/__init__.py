@@ -1 +1,25 @@
-from nwb_mcp_server.server import *
+import importlib
+import os
+
+
+def main() -> None:
+    # polars sizes its thread pool from the host CPU count when it is imported, which
+    # oversubscribes in containers: bound it before the server (and polars) is imported
+    os.environ.setdefault("POLARS_MAX_THREADS", str(min(8, os.cpu_count() or 1)))
+    importlib.import_module("nwb_mcp_server.server").main()
+
+
+def __getattr__(name: str) -> object:
+    # import the server lazily, so `main` runs before polars is imported
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    globals().update(
+        {
+            key: value
+            for key, value in vars(server_module).items()
+            if not key.startswith("_") and key != "main"
+        }
+    )
+    try:
+        return globals()[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
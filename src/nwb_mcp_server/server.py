@@ -2,26 +2,46 @@
 # dependencies = [
 #   "lazynwb",
 #   "fastmcp",
+#   "uvloop; sys_platform != 'win32'",
 # ]
 # ///
 
 import os
 
 os.environ["RUST_BACKTRACE"] = "1"  # enable Rust backtraces for lazynwb
+if __name__ == "__main__":
+    # run as a script: bound polars' thread pool before it is imported (see nwb_mcp_server.main)
+    os.environ.setdefault("POLARS_MAX_THREADS", str(min(8, os.cpu_count() or 1)))
 
 import asyncio
+import atexit
+import binascii
+import collections
 import concurrent.futures
 import contextlib
 import dataclasses
 import fnmatch
+import functools
+import hashlib
 import importlib.metadata
+import importlib.util
 import io
+import itertools
+import json
 import logging
+import logging.handlers
+import pathlib
+import queue
+import re
+import shutil
 import threading
-from collections.abc import AsyncIterator, Iterable
-from typing import Any, cast
+import time
+from collections.abc import AsyncIterator, Callable, Hashable, Iterable, Iterator
+from typing import Any, Literal, ParamSpec, TypeVar, cast
 
+import anyio
 import fastmcp
+import fsspec.asyn
 import fsspec.config
 import lazynwb
 import lazynwb.dandi
@@ -31,14 +51,45 @@ import pydantic
 import pydantic_settings
 import upath
 
+T = TypeVar("T")
+P = ParamSpec("P")
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-logger.addHandler(logging.StreamHandler())
-logger.info(
-    f"Starting MCP NWB Server v{importlib.metadata.version('nwb-mcp-server')} with lazynwb v{importlib.metadata.version('lazynwb')}"
-)
+# write log records from a background thread, so stderr I/O stays off the request path
+_log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 DEFAULT_GLOB_PATTERN = "**/*.nwb"
+GLOB_MAGIC_CHARACTERS = frozenset("*?[")
+IO_THREAD_POOL_SIZE = 16
+SERIALIZE_THREAD_POOL_SIZE = min(8, os.cpu_count() or 1)
+PREFETCH_HEADER_BYTES = 64 * 1024
+PREFETCH_MAX_SOURCES = 256
+NDJSON_BATCH_ROWS = 10_000
+QUERY_BATCH_CONCURRENCY = os.cpu_count() or 1
+# each result can have up to max_result_rows rows: bound the combined output of a batch
+QUERY_BATCH_MAX_QUERIES = 10
+ARROW_IPC_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+CACHE_DIR = (
+    pathlib.Path(os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache")
+    / "nwb-mcp-server"
+)
+GLOB_CACHE_DIR = CACHE_DIR / "glob"
+SCHEMA_CACHE_DIR = CACHE_DIR / "schema"
+# schema cache entries are pruned when a new one is written: least recently used beyond the cap,
+# and any unused for longer than the max age
+SCHEMA_CACHE_MAX_ENTRIES = 64
+SCHEMA_CACHE_MAX_AGE = 30 * 24 * 3600
+READ_ONLY_QUERY_KEYWORD_PATTERN = re.compile(r"(?:SELECT|WITH|SHOW)\b", re.IGNORECASE)
+EXPLAIN_KEYWORD_PATTERN = re.compile(r"EXPLAIN\b", re.IGNORECASE)
+READ_ONLY_QUERY_MESSAGE = (
+    "Only read-only queries are supported: SELECT, WITH ... SELECT, SHOW TABLES, or EXPLAIN"
+    " followed by one of these"
+)
 NO_SOURCE_CONFIGURED_MESSAGE = (
     "No dataset is currently active. First select one with "
     "`use_local_source(root_dir=...)` or `use_dandiset_source(dandiset_id=...)`. "
@@ -185,6 +236,58 @@ class ServerConfig(pydantic_settings.BaseSettings):
             " size for LLM context windows. Use allow_large_output on execute_query to bypass per-call."
         ),
     )
+    glob_cache: bool = pydantic.Field(
+        default=True,
+        description=(
+            "Cache the list of NWB files found with root_dir/glob_pattern on disk for remote"
+            " roots, so restarts can skip listing remote storage. Local roots are always"
+            " searched. Disable with --no-glob_cache."
+        ),
+    )
+    glob_cache_ttl: float = pydantic.Field(
+        default=3600,
+        description=(
+            "Maximum age in seconds of a cached NWB file list. Caches are also invalidated when"
+            " the searched directory reports a different modification time."
+        ),
+    )
+    schema_cache: bool = pydantic.Field(
+        default=True,
+        description=(
+            "Cache the table schemas inferred from local NWB files on disk, so restarts with"
+            " unchanged files skip schema inference. Disable with --no-schema_cache."
+        ),
+    )
+    glob_concurrency: int = pydantic.Field(
+        default=32,
+        description=(
+            "Maximum number of sub-directories of root_dir searched in parallel when glob_pattern"
+            " starts with '**/'."
+        ),
+    )
+    max_large_output_rows: int = pydantic.Field(
+        default=100_000,
+        description=(
+            "Maximum number of rows returned by a SQL query with allow_large_output, to bound the"
+            " memory and time spent serializing a result. Set to 0 for no limit."
+        ),
+    )
+    streaming: bool = pydantic.Field(
+        default=True,
+        description=(
+            "Collect query results with polars' streaming engine, which processes data in"
+            " batches instead of materializing intermediate frames. Disable with --no-streaming"
+            " to use the in-memory engine."
+        ),
+    )
+    query_cache_size: int = pydantic.Field(
+        default=128,
+        description=(
+            "Number of serialized query results kept per dataset, so a repeated query is answered"
+            " without running it again. Results from allow_large_output queries are not cached."
+            " Set to 0 to disable."
+        ),
+    )
     ignored_args: pydantic_settings.CliUnknownArgs
 
     def default_source_spec(self) -> SourceSpec:
@@ -209,6 +312,52 @@ class DatasetHandle:
     source_spec: SourceSpec
     sources: list[upath.UPath]
     db: pl.SQLContext
+    is_nwb: bool = True
+    schema_cache: dict[str, dict[str, pl.DataType]] = dataclasses.field(
+        default_factory=dict, repr=False
+    )
+    frame_cache: dict[str, pl.LazyFrame] = dataclasses.field(default_factory=dict, repr=False)
+    result_cache: collections.OrderedDict[Hashable, str] = dataclasses.field(
+        default_factory=collections.OrderedDict, repr=False
+    )
+
+    @functools.cached_property
+    def source_paths(self) -> tuple[str, ...]:
+        return tuple(p.as_posix() for p in self.sources)
+
+    @functools.cached_property
+    def tables(self) -> tuple[str, ...]:
+        return tuple(self.db.tables())
+
+    @functools.cached_property
+    def table_names(self) -> frozenset[str]:
+        return frozenset(self.tables)
+
+    def validate_table_name(self, table_name: str) -> None:
+        if table_name not in self.table_names:
+            raise ValueError(
+                f"Unknown table {table_name!r}. Use `get_tables` to list the available tables."
+            )
+
+    def get_table_schema(self, table_name: str) -> dict[str, pl.DataType]:
+        """Schemas are fixed for the lifetime of the SQL context, so each is resolved once."""
+        schema = self.schema_cache.get(table_name)
+        if schema is None:
+            self.validate_table_name(table_name)
+            logger.info("Resolving schema for table: %s", table_name)
+            schema = self.schema_cache[table_name] = dict(
+                self.get_table_frame(table_name).collect_schema()
+            )
+        return schema
+
+    def get_table_frame(self, table_name: str) -> pl.LazyFrame:
+        """The table's LazyFrame, planned from SQL once so previews and schemas skip the parser."""
+        lf = self.frame_cache.get(table_name)
+        if lf is None:
+            self.validate_table_name(table_name)
+            query = f"SELECT * FROM {format_table_name(table_name)}"
+            lf = self.frame_cache[table_name] = cast(pl.LazyFrame, self.db.execute(query))
+        return lf
 
 
 class SourceManager:
@@ -280,36 +429,34 @@ class SourceManager:
             return dataset
 
 
-config = ServerConfig()  # type: ignore[call-arg]
-logger.info(f"Configuration loaded: {config}")
-DEFAULT_SOURCE = config.default_source_spec()
+# command-line arguments are applied in `main`, so importing the module doesn't consume sys.argv
+config = ServerConfig(_cli_parse_args=False)  # type: ignore[call-arg]
+
 
 def _configure_anon(anon: bool) -> None:
-    logger.info(f"Setting anonymous S3 access: {anon}")
+    logger.info("Setting anonymous S3 access: %s", anon)
     fsspec.config.conf["s3"] = {"anon": anon}
     lazynwb.config.anon = True if anon else None
 
 
-if config.anon:
-    _configure_anon(True)
-
-UNATTENDED_RULE = (
-    (
-        "Never prompt the user for input or clarification. Work entirely autonomously and make principled"
-        "decisions based on the available data to achieve the most accurate and useful outcome."
+@functools.lru_cache(maxsize=2)
+def _build_rules(unattended: bool) -> str:
+    unattended_rule = (
+        (
+            "Never prompt the user for input or clarification. Work entirely autonomously and make principled"
+            "decisions based on the available data to achieve the most accurate and useful outcome."
+        )
+        if unattended
+        else ""
     )
-    if config.unattended
-    else ""
-)
-
-RULES = f"""
+    return f"""
 <rules>
 1. Always start in No Code Mode.
 2. Highlight any assumptions you make.
 3. Explain how you averaged or aggregated data, if applicable.
 4. Do not make things up.
 5. Do not provide an excessively positive picture. Be objective. Be critical where appropriate. 
-6. {UNATTENDED_RULE}
+6. {unattended_rule}
 </rules>
 """
 
@@ -337,6 +484,7 @@ def _build_code_mode_snippet_text(source_spec: SourceSpec) -> str:
     )
 
 
+@functools.lru_cache(maxsize=32)
 def _build_about(source_spec: SourceSpec) -> str:
     if not source_spec.is_configured:
         return """
@@ -383,6 +531,7 @@ b. Use `lazynwb` to interact with tables in the NWB files:
 """
 
 
+@functools.lru_cache(maxsize=32)
 def _build_nwb_file_search_code_snippet(source_spec: SourceSpec) -> str:
     if not source_spec.is_configured:
         raise ValueError(NO_SOURCE_CONFIGURED_MESSAGE)
@@ -411,9 +560,29 @@ def _build_nwb_file_search_code_snippet(source_spec: SourceSpec) -> str:
     return f"nwb_paths = list(upath.UPath({source_spec.root_dir!r}).glob({source_spec.glob_pattern!r}))"
 
 
+class QueryCoalescer:
+    """Shares one worker-thread execution between concurrent calls with the same key."""
+
+    def __init__(self) -> None:
+        self._pending: dict[Hashable, asyncio.Future[Any]] = {}
+
+    async def run(
+        self, key: Hashable, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+    ) -> T:
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield so a cancelled caller doesn't cancel the query for the others
+        return await asyncio.shield(task)
+
+
 @dataclasses.dataclass
 class AppContext:
     source_manager: SourceManager
+    serialize_executor: concurrent.futures.Executor
+    query_coalescer: QueryCoalescer = dataclasses.field(default_factory=QueryCoalescer)
 
 
 def _get_app_context(ctx: fastmcp.Context) -> AppContext:
@@ -476,32 +645,32 @@ def _get_dandiset_sources(
     version = source_spec.dandiset_version
 
     logger.info(
-        f"Fetching assets from DANDI dandiset {dandiset_id!r}"
-        + (f" version {version!r}" if version else " (latest version)")
+        "Fetching assets from DANDI dandiset %r %s",
+        dandiset_id,
+        f"version {version!r}" if version else "(latest version)",
     )
     if version is None:
         version = lazynwb.dandi._get_most_recent_dandiset_version(dandiset_id)
-        logger.info(f"Resolved dandiset version: {version!r}")
+        logger.info("Resolved dandiset version: %r", version)
 
     assets = lazynwb.dandi._get_dandiset_assets(dandiset_id, version=version)
-    logger.info(f"Found {len(assets)} total assets in dandiset {dandiset_id!r}")
+    logger.info("Found %d total assets in dandiset %r", len(assets), dandiset_id)
 
     if source_spec.dandiset_path_filter:
         original_count = len(assets)
-        assets = [
-            a
-            for a in assets
-            if fnmatch.fnmatchcase(a["path"], source_spec.dandiset_path_filter)
-        ]
+        path_filter = _compile_fnmatch_pattern(source_spec.dandiset_path_filter)
+        assets = [a for a in assets if path_filter.match(a["path"]) is not None]
         logger.info(
-            f"Filtered to {len(assets)} assets matching {source_spec.dandiset_path_filter!r}"
-            f" (from {original_count})"
+            "Filtered to %d assets matching %r (from %d)",
+            len(assets),
+            source_spec.dandiset_path_filter,
+            original_count,
         )
 
     original_count = len(assets)
     assets = [a for a in assets if str(a["path"]).lower().endswith(".nwb")]
     logger.info(
-        f"Filtered to {len(assets)} NWB assets ending in '.nwb' (from {original_count})"
+        "Filtered to %d NWB assets ending in '.nwb' (from %d)", len(assets), original_count
     )
 
     if not assets:
@@ -514,7 +683,7 @@ def _get_dandiset_sources(
             )
         )
 
-    logger.info(f"Fetching presigned S3 URLs for {len(assets)} assets (parallel)")
+    logger.info("Fetching presigned S3 URLs for %d assets (parallel)", len(assets))
     executor = lazynwb.utils.get_threadpool_executor()
     future_to_asset: dict[concurrent.futures.Future[str], dict] = {
         executor.submit(
@@ -529,7 +698,7 @@ def _get_dandiset_sources(
             s3_urls.append(future.result())
         except Exception as exc:
             logger.warning(
-                f"Failed to get S3 URL for asset {asset.get('path')!r}: {exc!r}"
+                "Failed to get S3 URL for asset %r: %r", asset.get("path"), exc
             )
 
     if not s3_urls:
@@ -537,11 +706,264 @@ def _get_dandiset_sources(
             f"Failed to retrieve any S3 URLs from dandiset {dandiset_id!r}"
         )
 
-    logger.info(f"Retrieved {len(s3_urls)} S3 URLs from DANDI")
+    logger.info("Retrieved %d S3 URLs from DANDI", len(s3_urls))
     resolved_source = dataclasses.replace(source_spec, dandiset_version=version)
     return resolved_source, [upath.UPath(url) for url in s3_urls]
 
 
+def _split_glob(pattern: str) -> tuple[str, str]:
+    """Split a glob pattern into its literal leading directories and the remaining pattern."""
+    parts = pathlib.PurePosixPath(pattern).parts
+    for idx, part in enumerate(parts):
+        if GLOB_MAGIC_CHARACTERS.intersection(part):
+            return "/".join(parts[:idx]), "/".join(parts[idx:])
+    return "/".join(parts), ""
+
+
+def _glob_nwb_sources(root: upath.UPath, glob_pattern: str) -> Iterable[upath.UPath]:
+    # only walk below the literal part of the pattern: each listdir is a round trip on remote
+    # storage
+    literal_prefix, remaining_pattern = _split_glob(glob_pattern)
+    search_root = root
+    if literal_prefix:
+        search_root = search_root / literal_prefix
+    if not remaining_pattern:
+        return [search_root] if search_root.exists() else []
+    if remaining_pattern.startswith("**/"):
+        if not isinstance(search_root, pathlib.Path):
+            return _find_remote(search_root, remaining_pattern)
+        return _parallel_recursive_glob(search_root, remaining_pattern)
+    return _glob(search_root, remaining_pattern)
+
+
+def _find_remote(search_root: upath.UPath, pattern: str) -> list[upath.UPath]:
+    """Recursively list a remote directory with one `fs.find` and match paths to a glob pattern.
+
+    Object stores list every key under a prefix in a single paginated request, which is much
+    faster than walking the 'directories' one listing at a time. Directories are listed too, so
+    directory-shaped stores (e.g. `*.zarr.nwb`) can match. Paths are only wrapped in UPath
+    objects once they have matched.
+    """
+    path_regex = _compile_glob(pattern)
+    root_path = search_root.path.rstrip("/")
+    fs = search_root.fs
+    try:
+        if isinstance(fs, fsspec.asyn.AsyncFileSystem) and not fs.asynchronous:
+            found = _find_concurrently(fs, root_path)
+        else:
+            found = fs.find(root_path, withdirs=True)
+    except FileNotFoundError:
+        return []
+    relative_paths = (path[len(root_path) :].strip("/") for path in found)
+    return [
+        search_root / relative_path
+        for relative_path in relative_paths
+        if path_regex.fullmatch(relative_path) is not None
+    ]
+
+
+def _find_concurrently(fs: fsspec.asyn.AsyncFileSystem, root_path: str) -> list[str]:
+    """Run one `_find` coroutine per top-level directory on the filesystem's event loop, so large
+    prefixes are paginated concurrently instead of in one sequential listing."""
+    entries = fs.ls(root_path, detail=True)
+    # top-level directories are candidates too (e.g. `*.zarr.nwb` stores)
+    found = dict.fromkeys(entry["name"] for entry in entries)
+    top_level_dirs = [entry["name"] for entry in entries if entry["type"] == "directory"]
+
+    async def find_all() -> list[list[str]]:
+        semaphore = asyncio.Semaphore(config.glob_concurrency)
+
+        async def find(path: str) -> list[str]:
+            async with semaphore:
+                return await fs._find(path, withdirs=True)
+
+        return await asyncio.gather(*(find(path) for path in top_level_dirs))
+
+    for dir_found in fsspec.asyn.sync(fs.loop, find_all):
+        found.update(dict.fromkeys(dir_found))
+    return list(found)
+
+
+def _glob(search_root: upath.UPath, pattern: str) -> Iterator[upath.UPath]:
+    """Glob with os.scandir for local directories and single-component patterns, otherwise
+    UPath.glob.
+
+    DirEntry file types come with the directory listing, which saves a stat per entry compared
+    with pathlib's glob.
+    """
+    if not isinstance(search_root, pathlib.Path) or "/" in pattern or "**" in pattern:
+        return search_root.glob(pattern)
+    # match case-insensitively on Windows, like pathlib
+    path_regex = _compile_glob(pattern, ignore_case=os.name == "nt")
+    return (
+        upath.UPath(path)
+        for path in _walk_scandir(os.fspath(search_root), path_regex, recursive=False)
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_fnmatch_pattern(pattern: str, ignore_case: bool = False) -> re.Pattern[str]:
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE if ignore_case else 0)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_glob(pattern: str, ignore_case: bool = False) -> re.Pattern[str]:
+    """Compile a glob pattern into one regex over '/'-separated relative paths.
+
+    Unlike fnmatch, wildcards don't cross directory boundaries and a '**' component matches zero
+    or more directories, so whole paths can be matched in one step instead of per component.
+    """
+    components = pattern.split("/")
+    parts = []
+    for idx, component in enumerate(components):
+        is_last = idx == len(components) - 1
+        if component == "**":
+            parts.append(".*" if is_last else "(?:[^/]+/)*")
+        else:
+            parts.append(_translate_glob_component(component) + ("" if is_last else "/"))
+    return re.compile("".join(parts), re.IGNORECASE if ignore_case else 0)
+
+
+def _translate_glob_component(component: str) -> str:
+    parts = []
+    idx = 0
+    while idx < len(component):
+        char = component[idx]
+        idx += 1
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and (end := _find_bracket_end(component, idx)) != -1:
+            chars = component[idx:end].replace("\\", "\\\\")
+            idx = end + 1
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            elif chars.startswith("^"):
+                chars = "\\" + chars
+            parts.append(f"[{chars}]")
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts)
+
+
+def _find_bracket_end(component: str, start: int) -> int:
+    # like fnmatch, a leading '!' negates and a ']' straight after it is a literal
+    idx = start
+    if component.startswith("!", idx):
+        idx += 1
+    if component.startswith("]", idx):
+        idx += 1
+    return component.find("]", idx)
+
+
+def _walk_scandir(
+    root: str, path_regex: re.Pattern[str], *, recursive: bool, prefix: str = ""
+) -> Iterator[str]:
+    """Yield paths below `root` whose '/'-joined path relative to the search root matches."""
+    try:
+        with os.scandir(root) as entries:
+            subdirs = []
+            for entry in entries:
+                relative_path = prefix + entry.name
+                if path_regex.fullmatch(relative_path) is not None:
+                    yield entry.path
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    subdirs.append((entry.path, relative_path + "/"))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    for subdir, subdir_prefix in subdirs:
+        yield from _walk_scandir(subdir, path_regex, recursive=True, prefix=subdir_prefix)
+
+
+def _parallel_recursive_glob(search_root: upath.UPath, pattern: str) -> list[upath.UPath]:
+    """Glob a local '**/' pattern by walking each top-level directory in its own thread."""
+    path_regex = _compile_glob(pattern, ignore_case=os.name == "nt")
+    try:
+        with os.scandir(os.fspath(search_root)) as it:
+            entries = list(it)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        # skip unreadable directories, like pathlib's glob
+        return []
+    matches = [entry.path for entry in entries if path_regex.fullmatch(entry.name) is not None]
+    top_level_dirs = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+    if top_level_dirs:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(config.glob_concurrency, len(top_level_dirs))),
+            thread_name_prefix="nwb-glob",
+        ) as executor:
+            for dir_matches in executor.map(
+                lambda entry: list(
+                    _walk_scandir(
+                        entry.path, path_regex, recursive=True, prefix=entry.name + "/"
+                    )
+                ),
+                top_level_dirs,
+            ):
+                matches.extend(dir_matches)
+    return [upath.UPath(path) for path in matches]
+
+
+def _get_glob_cache_path(root_dir: str, glob_pattern: str) -> pathlib.Path:
+    key = hashlib.blake2b(f"{root_dir}|{glob_pattern}".encode(), digest_size=16).hexdigest()
+    return GLOB_CACHE_DIR / f"{key}.json"
+
+
+def _get_search_root_mtime(root: upath.UPath, glob_pattern: str) -> float | None:
+    literal_prefix = _split_glob(glob_pattern)[0]
+    search_root = root / literal_prefix if literal_prefix else root
+    try:
+        return search_root.stat().st_mtime
+    except Exception:
+        # remote directories generally have no mtime: rely on the ttl alone
+        return None
+
+
+def _read_glob_cache(
+    cache_path: pathlib.Path, root: upath.UPath, glob_pattern: str, *, ttl: float
+) -> list[upath.UPath] | None:
+    """Return the cached NWB file list, or None if it is missing or stale."""
+    try:
+        cache_mtime = cache_path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if time.time() - cache_mtime > ttl:
+        logger.info("Ignoring expired NWB file list cache %s", cache_path)
+        return None
+    try:
+        cache = json.loads(cache_path.read_text())
+        relative_paths = cache["relative_paths"]
+    except (OSError, ValueError, KeyError) as exc:
+        logger.warning("Failed to read NWB file list cache %s: %r", cache_path, exc)
+        return None
+    search_root_mtime = _get_search_root_mtime(root, glob_pattern)
+    if search_root_mtime is not None and search_root_mtime != cache.get("search_root_mtime"):
+        logger.info("Ignoring NWB file list cache %s: %s has been modified", cache_path, root)
+        return None
+    # join onto the root so every source shares its filesystem instance and storage options
+    nwb_paths = [root / relative_path for relative_path in relative_paths]
+    logger.info("Loaded %d data sources from cache %s", len(nwb_paths), cache_path)
+    return nwb_paths
+
+
+def _write_glob_cache(
+    cache_path: pathlib.Path,
+    root: upath.UPath,
+    sources: list[upath.UPath],
+    search_root_mtime: float | None,
+) -> None:
+    try:
+        relative_paths = [p.relative_to(root).as_posix() for p in sources]
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(
+            json.dumps(
+                {"relative_paths": relative_paths, "search_root_mtime": search_root_mtime}
+            )
+        )
+    except (OSError, ValueError) as exc:
+        logger.warning("Failed to write NWB file list cache %s: %r", cache_path, exc)
+
+
 def _get_local_or_remote_nwb_sources(
     source_spec: SourceSpec,
 ) -> tuple[SourceSpec, list[upath.UPath]]:
@@ -549,14 +971,40 @@ def _get_local_or_remote_nwb_sources(
     if source_spec.root_dir is None or source_spec.glob_pattern is None:
         raise ValueError(NO_SOURCE_CONFIGURED_MESSAGE)
     logger.info(
-        f"Searching for NWB files in {source_spec.root_dir!r} with pattern {source_spec.glob_pattern!r}"
+        "Searching for NWB files in %r with pattern %r",
+        source_spec.root_dir,
+        source_spec.glob_pattern,
+    )
+    root = upath.UPath(source_spec.root_dir)
+    # a local search is cheaper than reading and validating a cached list
+    cache_path = (
+        _get_glob_cache_path(source_spec.root_dir, source_spec.glob_pattern)
+        if config.glob_cache and not isinstance(root, pathlib.Path)
+        else None
+    )
+    nwb_paths = (
+        _read_glob_cache(cache_path, root, source_spec.glob_pattern, ttl=config.glob_cache_ttl)
+        if cache_path is not None
+        else None
     )
-    nwb_paths = list(upath.UPath(source_spec.root_dir).glob(source_spec.glob_pattern))
+    if nwb_paths is None:
+        # record the mtime before searching, so files added during the search invalidate the cache
+        search_root_mtime = (
+            _get_search_root_mtime(root, source_spec.glob_pattern)
+            if cache_path is not None
+            else None
+        )
+        # sort so the files used for schema inference don't depend on listing order
+        nwb_paths = sorted(
+            _glob_nwb_sources(root, source_spec.glob_pattern), key=lambda p: p.as_posix()
+        )
+        if cache_path is not None and nwb_paths:
+            _write_glob_cache(cache_path, root, nwb_paths, search_root_mtime)
     if not nwb_paths:
         raise ValueError(
             f"No NWB files found in {source_spec.root_dir!r} matching pattern {source_spec.glob_pattern!r}"
         )
-    logger.info(f"Found {len(nwb_paths)} data sources")
+    logger.info("Found %d data sources", len(nwb_paths))
     return source_spec, nwb_paths
 
 
@@ -565,8 +1013,10 @@ def _get_nwb_sources(source_spec: SourceSpec) -> tuple[SourceSpec, list[upath.UP
     if source_spec.dandiset_id:
         if source_spec.root_dir is not None:
             logger.warning(
-                f"Both dandiset_id={source_spec.dandiset_id!r} and root_dir={source_spec.root_dir!r} are set."
-                " Using DANDI (root_dir/glob_pattern are ignored)."
+                "Both dandiset_id=%r and root_dir=%r are set."
+                " Using DANDI (root_dir/glob_pattern are ignored).",
+                source_spec.dandiset_id,
+                source_spec.root_dir,
             )
         return _get_dandiset_sources(source_spec)
     return _get_local_or_remote_nwb_sources(source_spec)
@@ -606,52 +1056,242 @@ def create_sql_context_non_nwb(sources: Iterable[upath.UPath]) -> pl.SQLContext:
     return pl.SQLContext(frames=frames, eager=False)
 
 
+def _prefetch_headers(sources: Iterable[upath.UPath]) -> None:
+    """Read the start of local files concurrently so the OS page cache is warm when lazynwb
+    opens them one by one."""
+    local_paths = [os.fspath(p) for p in sources if isinstance(p, pathlib.Path)]
+    if not local_paths or len(local_paths) > PREFETCH_MAX_SOURCES:
+        return
+    executor = lazynwb.utils.get_threadpool_executor()
+    for _ in executor.map(_read_header, local_paths):
+        pass
+
+
+def _read_header(path: str) -> None:
+    try:
+        with open(path, "rb") as f:
+            f.read(PREFETCH_HEADER_BYTES)
+    except OSError:
+        pass  # directories (e.g. zarr) and unreadable files are left to lazynwb
+
+
+def _get_schema_cache_dir(
+    sources: list[upath.UPath],
+    *,
+    infer_schema_length: int,
+    table_names: list[str] | None,
+) -> pathlib.Path | None:
+    """Key the schema cache on the identity of every source file, or return None if any source
+    is remote (mtimes are unreliable and each stat is a round trip)."""
+    if not all(isinstance(p, pathlib.Path) for p in sources):
+        return None
+    executor = lazynwb.utils.get_threadpool_executor()
+    try:
+        stats = list(executor.map(os.stat, sources))
+    except OSError:
+        return None
+    key = hashlib.blake2b(digest_size=16)
+    key.update(
+        repr(
+            (
+                importlib.metadata.version("lazynwb"),
+                infer_schema_length,
+                sorted(table_names or []),
+                [
+                    (p.as_posix(), stat.st_mtime_ns, stat.st_size)
+                    for p, stat in zip(sources, stats)
+                ],
+            )
+        ).encode()
+    )
+    return SCHEMA_CACHE_DIR / key.hexdigest()
+
+
+def _read_schema_cache(cache_dir: pathlib.Path) -> dict[str, dict[str, pl.DataType]] | None:
+    """Read table schemas from the Arrow IPC headers listed in the cache manifest."""
+    manifest_path = cache_dir / "manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text())
+        table_schemas = {
+            table_name: dict(pl.read_ipc_schema(cache_dir / file_name))
+            for table_name, file_name in manifest["tables"].items()
+        }
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        logger.warning("Failed to read schema cache %s: %r", cache_dir, exc)
+        return None
+    # mark the entry as recently used, so pruning keeps it
+    with contextlib.suppress(OSError):
+        os.utime(manifest_path)
+    logger.info("Loaded schemas for %d tables from cache %s", len(table_schemas), cache_dir)
+    return table_schemas
+
+
+def _resolve_table_schemas(sql_context: pl.SQLContext) -> dict[str, dict[str, pl.DataType]]:
+    return {
+        table_name: dict(
+            cast(
+                pl.LazyFrame, sql_context.execute(f"SELECT * FROM {format_table_name(table_name)}")
+            ).collect_schema()
+        )
+        for table_name in sql_context.tables()
+    }
+
+
+def _write_schema_cache(
+    cache_dir: pathlib.Path, table_schemas: dict[str, dict[str, pl.DataType]]
+) -> None:
+    """Write each schema as an empty Arrow IPC file, which is stable across polars versions,
+    then the manifest that maps table names (which contain '/') to the files."""
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        file_names = {}
+        for idx, (table_name, schema) in enumerate(table_schemas.items()):
+            file_names[table_name] = file_name = f"{idx}.arrow"
+            pl.DataFrame(schema=schema).write_ipc(cache_dir / file_name)
+        # the manifest is written last and atomically: its presence marks a complete cache entry
+        tmp_path = cache_dir / f"manifest.json.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps({"tables": file_names}))
+        os.replace(tmp_path, cache_dir / "manifest.json")
+    except (OSError, pl.exceptions.PolarsError) as exc:
+        logger.warning("Failed to write schema cache %s: %r", cache_dir, exc)
+        return
+    _prune_schema_cache(keep=cache_dir)
+
+
+def _prune_schema_cache(keep: pathlib.Path) -> None:
+    """Remove the least recently used entries beyond SCHEMA_CACHE_MAX_ENTRIES, and entries
+    unused for longer than SCHEMA_CACHE_MAX_AGE. Recency is the manifest mtime, which is bumped
+    on every read."""
+    entries = []
+    try:
+        with os.scandir(keep.parent) as it:
+            for entry in it:
+                if entry.path == os.fspath(keep) or not entry.is_dir():
+                    continue
+                try:
+                    mtime = os.stat(os.path.join(entry.path, "manifest.json")).st_mtime
+                except FileNotFoundError:
+                    # incomplete entry: age it by the directory itself
+                    mtime = entry.stat().st_mtime
+                entries.append((mtime, entry.path))
+    except OSError as exc:
+        logger.warning("Failed to prune schema cache %s: %r", keep.parent, exc)
+        return
+    entries.sort(reverse=True)
+    min_mtime = time.time() - SCHEMA_CACHE_MAX_AGE
+    # the entry just written counts towards the cap
+    for idx, (mtime, path) in enumerate(entries, start=1):
+        if idx >= SCHEMA_CACHE_MAX_ENTRIES or mtime < min_mtime:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _create_sql_context_from_schemas(
+    sources: list[upath.UPath], table_schemas: dict[str, dict[str, pl.DataType]]
+) -> pl.SQLContext:
+    """Register lazynwb scans with known schemas, which skips opening files to infer them."""
+    sql_context = pl.SQLContext(eager=False)
+    for table_name, schema in table_schemas.items():
+        sql_context.register(
+            table_name,
+            lazynwb.scan_nwb(
+                source=sources,
+                # table names are internal paths, normalized as in lazynwb.get_sql_context
+                table_path=lazynwb.utils.normalize_internal_file_path(table_name),
+                ignore_errors=True,
+                disable_progress=True,
+                schema=schema,
+            ),
+        )
+    return sql_context
+
+
 def _build_dataset_handle(
     source_spec: SourceSpec,
     *,
     infer_schema_length: int,
     table_names: list[str] | None,
 ) -> DatasetHandle:
-    logger.info(f"Initializing SQL connection for source: {source_spec.to_dict()}")
+    logger.info("Initializing SQL connection for source: %s", source_spec)
     if source_spec.anon:
         _configure_anon(True)
     resolved_source_spec, sources = _get_nwb_sources(source_spec)
-    if not source_spec.is_dandiset and not any(
-        ".nwb" in str(s).lower() for s in sources
-    ):
+    is_nwb = source_spec.is_dandiset or any(".nwb" in str(s).lower() for s in sources)
+    # schemas resolved while building also seed the DatasetHandle's memo
+    table_schemas: dict[str, dict[str, pl.DataType]] | None = None
+    if not is_nwb:
         logger.warning("No NWB files found, creating SQLContext for non-NWB sources")
         sql_context = create_sql_context_non_nwb(sources)
     else:
-        sql_context = lazynwb.get_sql_context(
-            nwb_sources=sources,
-            infer_schema_length=infer_schema_length,
-            table_names=table_names,
-            exclude_timeseries=False,
-            full_path=True,  # if False, NWB objects will be referenced by their names, not full paths, e.g. 'epochs' instead of '/intervals/epochs'
-            disable_progress=True,
-            eager=False,  # if False, a LazyFrame is returned from `execute`
-            rename_general_metadata=True,  # renames the metadata in 'general' as 'session'
+        cache_dir = (
+            _get_schema_cache_dir(
+                sources, infer_schema_length=infer_schema_length, table_names=table_names
+            )
+            if config.schema_cache
+            else None
         )
+        table_schemas = _read_schema_cache(cache_dir) if cache_dir is not None else None
+        if table_schemas is not None:
+            sql_context = _create_sql_context_from_schemas(sources, table_schemas)
+        else:
+            _prefetch_headers(sources)
+            sql_context = lazynwb.get_sql_context(
+                nwb_sources=sources,
+                infer_schema_length=infer_schema_length,
+                table_names=table_names,
+                exclude_timeseries=False,
+                full_path=True,  # if False, NWB objects will be referenced by their names, not full paths, e.g. 'epochs' instead of '/intervals/epochs'
+                disable_progress=True,
+                eager=False,  # if False, a LazyFrame is returned from `execute`
+                rename_general_metadata=True,  # renames the metadata in 'general' as 'session'
+            )
+            if cache_dir is not None:
+                table_schemas = _resolve_table_schemas(sql_context)
+                _write_schema_cache(cache_dir, table_schemas)
     logger.info("SQL connection initialized successfully")
     return DatasetHandle(
-        source_spec=resolved_source_spec, sources=sources, db=sql_context
+        source_spec=resolved_source_spec,
+        sources=sources,
+        db=sql_context,
+        is_nwb=is_nwb,
+        schema_cache=dict(table_schemas or {}),
     )
 
 
 @contextlib.asynccontextmanager
 async def server_lifespan(server: fastmcp.FastMCP) -> AsyncIterator[AppContext]:
     """Manage server startup and shutdown lifecycle."""
+    logger.info(
+        "Starting MCP NWB Server v%s with lazynwb v%s",
+        importlib.metadata.version("nwb-mcp-server"),
+        importlib.metadata.version("lazynwb"),
+    )
+    if config.anon:
+        _configure_anon(True)
     source_manager = SourceManager(
-        default_source=DEFAULT_SOURCE,
+        default_source=config.default_source_spec(),
         infer_schema_length=config.infer_schema_length,
         tables=config.tables,
     )
+    # a single long-lived pool for asyncio.to_thread, instead of the loop's lazily-grown default
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="nwb-io"
+    )
+    asyncio.get_running_loop().set_default_executor(executor)
+    # separate CPU-bound pool, so encoding large results doesn't take threads from queries
+    serialize_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=SERIALIZE_THREAD_POOL_SIZE, thread_name_prefix="nwb-serialize"
+    )
     logger.info("Initializing startup dataset configuration")
-    source_manager.preload_default_dataset()
+    # file discovery and schema inference block for seconds: keep the event loop responsive
+    await asyncio.to_thread(source_manager.preload_default_dataset)
     try:
-        yield AppContext(source_manager=source_manager)
+        yield AppContext(source_manager=source_manager, serialize_executor=serialize_executor)
     finally:
         await asyncio.to_thread(lazynwb.clear_cache)
+        serialize_executor.shutdown(wait=False, cancel_futures=True)
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 server = fastmcp.FastMCP(
@@ -671,7 +1311,7 @@ def get_tables(ctx: fastmcp.Context) -> list[str]:
     experiment-level context (e.g. `experiment_description`, subject info).
     """
     logger.info("Fetching available tables from NWB files")
-    return _get_dataset_for_request(ctx).db.tables()
+    return list(_get_dataset_for_request(ctx).tables)
 
 
 @server.tool()
@@ -682,10 +1322,8 @@ def get_table_schema(table_name: str, ctx: fastmcp.Context) -> dict[str, pl.Data
     """
     if not table_name:
         raise ValueError("Table name cannot be empty")
-    logger.info(f"Fetching schema for table: {table_name}")
-    query = f"SELECT * FROM {format_table_name(table_name)} LIMIT 0"
-    lf = cast(pl.LazyFrame, _get_dataset_for_request(ctx).db.execute(query))
-    return lf.schema
+    logger.info("Fetching schema for table: %s", table_name)
+    return _get_dataset_for_request(ctx).get_table_schema(table_name)
 
 
 @server.tool()
@@ -767,6 +1405,7 @@ async def execute_query(
     query: str,
     ctx: fastmcp.Context,
     allow_large_output: bool = False,
+    format: Literal["json", "ndjson", "arrow"] = "json",
 ) -> str:
     """Executes a SQL query against a virtual read-only NWB database,
     returning results as JSON. Uses PostgreSQL syntax and functions for basic analysis.
@@ -776,19 +1415,102 @@ async def execute_query(
 
     Set allow_large_output=True ONLY when the result will be written to a file or piped to an
     external tool — do NOT use it for inline analysis, as large results will fill the context window.
+    Even then, results are capped at max_large_output_rows (default 100,000).
+
+    Set format="arrow" only when the result will be passed to a program: it returns JSON with
+    the result as base64-encoded, LZ4-compressed Arrow IPC stream data (`data_b64`, readable with
+    `pyarrow.ipc.open_stream` or `polars.read_ipc_stream`), which is much smaller and faster to
+    produce than JSON for large results but is not human-readable.
+    Set format="ndjson" to get one JSON object per line, e.g. when writing large results to a file.
 
     Tables are lazily loaded — aggregations like COUNT(*) or COUNT(DISTINCT ...) force full
     materialization and can be slow on large datasets. When selecting array/list columns
     (e.g. spike_times, waveform_mean), always pre-filter rows using scalar columns first.
     """
-    return await _execute_query(query, ctx, allow_large_output=allow_large_output)
+    return await _execute_query(
+        query, ctx, allow_large_output=allow_large_output, format=format
+    )
+
+
+@server.tool()
+async def execute_queries(
+    queries: list[str],
+    ctx: fastmcp.Context,
+    format: Literal["json", "ndjson", "arrow"] = "json",
+) -> list[str]:
+    """Executes up to 10 independent SQL queries concurrently, returning one result per query
+    in the same order. Prefer this over repeated `execute_query` calls when the queries don't
+    depend on each other's results. Each result follows the rules of `execute_query`
+    (row limit, formats); allow_large_output is not supported here. A query that fails returns
+    "Error: <message>" in its place, without affecting the other results.
+    """
+    return await _execute_queries(queries, ctx, format=format)
+
+
+async def _execute_queries(
+    queries: list[str],
+    ctx: fastmcp.Context,
+    format: Literal["json", "ndjson", "arrow"] = "json",
+) -> list[str]:
+    if not queries:
+        raise ValueError("Must provide at least one SQL query")
+    if len(queries) > QUERY_BATCH_MAX_QUERIES:
+        raise ValueError(
+            f"Got {len(queries)} queries, exceeding the limit of {QUERY_BATCH_MAX_QUERIES} per"
+            " call. Split them across several calls."
+        )
+    # polars releases the GIL while executing, so queries run in parallel on worker threads
+    semaphore = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+
+    async def run(query: str) -> str:
+        async with semaphore:
+            return await _execute_query(query, ctx, format=format)
+
+    results = await asyncio.gather(*(run(query) for query in queries), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+    return [
+        f"Error: {result}" if isinstance(result, Exception) else result for result in results
+    ]
+
+
+def _is_read_only_query(query: str) -> bool:
+    """Check the leading keyword of a query before polars parses it, skipping whitespace, comments
+    and opening parentheses in a single linear pass.
+
+    EXPLAIN is only allowed in front of a read-only query: polars executes `EXPLAIN DROP TABLE`.
+    """
+    pos, end = 0, len(query)
+    while pos < end:
+        if query[pos].isspace() or query[pos] == "(":
+            pos += 1
+        elif query.startswith("--", pos):
+            newline = query.find("\n", pos)
+            if newline == -1:
+                return False
+            pos = newline + 1
+        elif query.startswith("/*", pos):
+            comment_end = query.find("*/", pos + 2)
+            if comment_end == -1:
+                return False
+            pos = comment_end + 2
+        elif (match := EXPLAIN_KEYWORD_PATTERN.match(query, pos)) is not None:
+            pos = match.end()
+        else:
+            return READ_ONLY_QUERY_KEYWORD_PATTERN.match(query, pos) is not None
+    return False
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
 
 
 def format_table_name(table: str) -> str:
     """Ensures the table name is properly formatted for pl.SQLContext queries."""
     if not table:
         raise ValueError("Table name cannot be empty")
-    return f'"{table}"'
+    return _quote_identifier(table)
 
 
 def format_column_names(columns: Iterable[str] | None) -> str:
@@ -797,7 +1519,7 @@ def format_column_names(columns: Iterable[str] | None) -> str:
         return "*"
     if isinstance(columns, str):
         columns = [columns]
-    return ", ".join(repr(c) for c in columns).replace("'", '"')
+    return ", ".join(_quote_identifier(c) for c in columns)
 
 
 @server.tool()
@@ -809,41 +1531,223 @@ async def preview_table_values(
 ) -> str:
     """Returns the first row of a table to preview values. Prefer `get_table_schema` to get the
     table schema. Only use this if absolutely necessary — even a 1-row preview can be slow on
-    remote/cloud NWB files."""
-    column_query = format_column_names(columns)
-    query = f"SELECT {column_query} FROM {format_table_name(table)} LIMIT {n_rows};"
-    logger.info(f"Previewing table values with: {column_query}")
-    return await _execute_query(query, ctx)
+    remote/cloud NWB files. With n_rows=0, returns the data types of the columns instead, without
+    reading any data."""
+    dataset = _get_dataset_for_request(ctx)
+    dataset.validate_table_name(table)
+    # pydantic validates Iterable arguments as one-shot iterators
+    columns = [columns] if isinstance(columns, str) else list(columns or [])
+    logger.info("Previewing table values with: %s", format_column_names(columns))
+    if n_rows < 0:
+        raise ValueError(f"n_rows={n_rows} cannot be negative")
+    if n_rows > config.max_result_rows:
+        raise ValueError(
+            f"n_rows={n_rows} exceeds the row limit of {config.max_result_rows}. "
+            "Use `execute_query` for larger results."
+        )
+    if n_rows == 0:
+        schema = await asyncio.to_thread(dataset.get_table_schema, table)
+        return json.dumps(_select_schema_columns(schema, columns))
+    df = await asyncio.to_thread(_collect_table_preview, dataset, table, columns, n_rows)
+    if df.is_empty():
+        logger.warning("Table preview returned no results")
+        return "[]"
+    return df.write_json()
 
 
 async def _execute_query(
-    query: str, ctx: fastmcp.Context, allow_large_output: bool = False
+    query: str,
+    ctx: fastmcp.Context,
+    allow_large_output: bool = False,
+    format: Literal["json", "ndjson", "arrow"] = "json",
 ) -> str:
     """Executes a SQL query against a virtual read-only NWB database,
     returning results as JSON. Uses PostgreSQL syntax and functions for basic analysis.
     """
     if not query:
         raise ValueError("SQL query cannot be empty")
-    logger.info(f"Executing query: {query}")
-    df: pl.DataFrame = _get_dataset_for_request(ctx).db.execute(query, eager=True)
+    if not _is_read_only_query(query):
+        raise ValueError(READ_ONLY_QUERY_MESSAGE)
+    logger.info("Executing query: %s", query)
+    dataset = _get_dataset_for_request(ctx)
+    db = dataset.db
+    row_limit = _get_row_limit(allow_large_output)
+    json_safe = format != "arrow"
+    # sources are fixed for the lifetime of a dataset, so the same query gives the same result
+    cache_key = (query, format)
+    if not allow_large_output and (cached := _get_cached_result(dataset, cache_key)) is not None:
+        return cached
+    df = await _get_app_context(ctx).query_coalescer.run(
+        (id(db), query, row_limit, json_safe), _collect_query, db, query, row_limit, json_safe
+    )
     if df.is_empty():
         logger.warning("SQL query returned no results")
-        return "[]"
-    if not allow_large_output and df.shape[0] > config.max_result_rows:
+        if format == "json":
+            if not allow_large_output:
+                _cache_result(dataset.result_cache, cache_key, "[]")
+            return "[]"
+    _check_row_limit(df, allow_large_output, row_limit)
+    serializer, format_name = _get_serializer(format)
+    logger.info("Query executed successfully, serializing %d rows as %s", len(df), format_name)
+    if not allow_large_output:
+        # at most max_result_rows: cheaper to encode inline than to hop threads
+        result = serializer(df)
+        _cache_result(dataset.result_cache, cache_key, result)
+        return result
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_app_context(ctx).serialize_executor, serializer, df
+    )
+
+
+def _get_row_limit(allow_large_output: bool) -> int | None:
+    # fetch one row more than the limit, so an oversized result is detected without collecting it
+    if not allow_large_output:
+        return config.max_result_rows + 1
+    if config.max_large_output_rows > 0:
+        return config.max_large_output_rows + 1
+    return None
+
+
+def _check_row_limit(df: pl.DataFrame, allow_large_output: bool, row_limit: int | None) -> None:
+    if not allow_large_output and df.height > config.max_result_rows:
         raise ValueError(
-            f"Query returned {df.shape[0]} rows, exceeding the {config.max_result_rows}-row limit. "
+            f"Query returned more than {config.max_result_rows} rows, exceeding the row limit. "
             "Refine with WHERE/GROUP BY/LIMIT, or set allow_large_output=True only if the result "
             "will be written to a file (not read into context)."
         )
-    logger.info(f"Query executed successfully, serializing {len(df)} rows as JSON")
-    # return _to_markdown(df)
-    if "obs_intervals" in df.columns:
-        # lists of arrays cause JSON conversion to crash
-        # arrays are ok
-        # TODO report issue to polars
-        # TODO generalize to cast all list[array] columns
-        df = df.cast({"obs_intervals": pl.List(pl.List(pl.Float64))})
-    return df.write_json()
+    if allow_large_output and row_limit is not None and df.height >= row_limit:
+        raise ValueError(
+            f"Query returned more than {config.max_large_output_rows} rows, exceeding the row"
+            " limit for allow_large_output. Add a LIMIT or narrow the query with WHERE/GROUP BY."
+        )
+
+
+def _get_serializer(
+    format: Literal["json", "ndjson", "arrow"],
+) -> tuple[Callable[[pl.DataFrame], str], str]:
+    if format == "arrow":
+        return _to_arrow_ipc_json, "Arrow IPC"
+    if format == "ndjson":
+        return _to_ndjson, "NDJSON"
+    # return _to_markdown, "Markdown"
+    return pl.DataFrame.write_json, "JSON"
+
+
+def _get_cached_result(dataset: DatasetHandle, key: Hashable) -> str | None:
+    cached = dataset.result_cache.get(key)
+    if cached is not None:
+        logger.info("Returning cached result")
+        dataset.result_cache.move_to_end(key)
+    return cached
+
+
+def _get_collect_engine() -> Literal["streaming", "in-memory"]:
+    return "streaming" if config.streaming else "in-memory"
+
+
+def _cache_result(
+    cache: collections.OrderedDict[Hashable, str], key: Hashable, result: str
+) -> None:
+    if config.query_cache_size <= 0:
+        return
+    cache[key] = result
+    cache.move_to_end(key)
+    while len(cache) > config.query_cache_size:
+        cache.popitem(last=False)
+
+
+def _collect_query(
+    db: pl.SQLContext, query: str, row_limit: int | None, json_safe: bool = False
+) -> pl.DataFrame:
+    lf = cast(pl.LazyFrame, db.execute(query, eager=False))
+    if row_limit is not None:
+        lf = lf.limit(row_limit)
+    if json_safe:
+        lf = _cast_list_of_array_columns(lf)
+    return lf.collect(engine=_get_collect_engine())
+
+
+def _select_schema_columns(
+    schema: dict[str, pl.DataType], columns: list[str]
+) -> dict[str, str]:
+    if missing := [c for c in columns if c not in schema]:
+        raise ValueError(
+            f"Unknown columns {missing!r}. Use `get_table_schema` to list the available columns."
+        )
+    return {name: str(schema[name]) for name in columns or schema}
+
+
+def _collect_table_preview(
+    dataset: DatasetHandle, table: str, columns: list[str], n_rows: int
+) -> pl.DataFrame:
+    if dataset.is_nwb and n_rows > 0:
+        df = _collect_first_source_preview(dataset, table, columns, n_rows)
+        if not df.is_empty():
+            return df
+    lf = dataset.get_table_frame(table)
+    if columns:
+        lf = lf.select(columns)
+    return _cast_list_of_array_columns(lf.head(n_rows)).collect(engine=_get_collect_engine())
+
+
+def _collect_first_source_preview(
+    dataset: DatasetHandle, table: str, columns: Iterable[str] | None, n_rows: int
+) -> pl.DataFrame:
+    """Reads the first rows of a table from the first NWB file only, instead of planning a scan
+    over every file in the dataset. Empty if the table is not in that file."""
+    lf = lazynwb.scan_nwb(
+        source=dataset.sources[0],
+        table_path=lazynwb.utils.normalize_internal_file_path(table),
+        ignore_errors=True,
+        disable_progress=True,
+        # reuse the dataset schema: no inference, and the columns match the SQL table
+        schema=dataset.get_table_schema(table),
+    )
+    if columns:
+        lf = lf.select(columns)
+    return _cast_list_of_array_columns(lf.head(n_rows)).collect(engine=_get_collect_engine())
+
+
+def _cast_list_of_array_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Casts list[array] columns (e.g. units.obs_intervals) to list[list] in the query plan.
+
+    Lists of arrays cause JSON conversion to crash (arrays are ok).
+    """
+    # TODO report issue to polars
+    casts = {
+        name: json_safe_dtype
+        for name, dtype in lf.collect_schema().items()
+        if isinstance(dtype, pl.List)
+        and (json_safe_dtype := _arrays_to_lists(dtype)) != dtype
+    }
+    if not casts:
+        return lf
+    return lf.with_columns(pl.col(name).cast(dtype) for name, dtype in casts.items())
+
+
+def _arrays_to_lists(dtype: pl.DataType) -> pl.DataType:
+    """Replaces every (possibly multi-dimensional) array in a nested dtype with a list."""
+    if isinstance(dtype, (pl.List, pl.Array)):
+        return pl.List(_arrays_to_lists(dtype.inner))
+    return dtype
+
+
+def _to_arrow_ipc_json(df: pl.DataFrame) -> str:
+    buf = io.BytesIO()
+    # stream format: readers can consume record batches without seeking to a file footer
+    df.write_ipc_stream(buf, compression="lz4")
+    header = json.dumps({"format": "arrow-ipc-lz4", "media_type": ARROW_IPC_MEDIA_TYPE})
+    data_b64 = binascii.b2a_base64(buf.getbuffer(), newline=False).decode("ascii")
+    # base64 never needs JSON escaping: splice it in instead of having json.dumps scan a copy
+    return f'{header[:-1]}, "data_b64": "{data_b64}"}}'
+
+
+def _to_ndjson(df: pl.DataFrame) -> str:
+    # serialize in slices so only one batch of rows is being encoded at a time
+    buf = io.BytesIO()
+    for df_slice in df.iter_slices(n_rows=NDJSON_BATCH_ROWS):
+        df_slice.write_ndjson(buf)
+    return buf.getvalue().decode("utf-8")
 
 
 def _to_markdown(df: pl.DataFrame) -> str:
@@ -862,16 +1766,20 @@ def _to_markdown(df: pl.DataFrame) -> str:
 @server.resource("dir://nwb_paths")
 def nwb_paths(ctx: fastmcp.Context) -> list[str]:
     """List the available NWB files."""
-    return [p.as_posix() for p in _get_dataset_for_request(ctx).sources]
+    return list(_get_dataset_for_request(ctx).source_paths)
 
 
 @server.tool()
-def get_nwb_paths(ctx: fastmcp.Context) -> list[str]:
+def get_nwb_paths(ctx: fastmcp.Context, limit: int | None = None) -> list[str]:
     """Returns the list of all NWB file paths in the dataset (one file per session/subject).
     Call early to understand the scale of the dataset — file count shapes how to interpret
     aggregate query results (e.g. per-file breakdowns vs. overall averages).
+    Set `limit` to return only the first paths when `get_active_source` reports a large
+    `source_count`.
     """
-    return [p.as_posix() for p in _get_dataset_for_request(ctx).sources]
+    if limit is not None and limit < 0:
+        raise ValueError(f"limit={limit} cannot be negative")
+    return list(itertools.islice(_get_dataset_for_request(ctx).source_paths, limit))
 
 
 @server.prompt
@@ -884,7 +1792,7 @@ def analysis_report_prompt(query: str, ctx: fastmcp.Context) -> str:
 Please provide an analysis report for a scientist posing the following query:
 {query!r}
 
-{RULES}
+{_build_rules(config.unattended)}
 
 <instructions>
 1. Explore the available tables in No Code Mode to understand their schemas and relationships.
@@ -916,7 +1824,7 @@ def general_prompt(query: str, ctx: fastmcp.Context) -> str:
 Please provide a detailed response to a scientist posing the following query:
 {query!r}
 
-{RULES}
+{_build_rules(config.unattended)}
 
 <instructions>
 1. Explore the available tables in No Code Mode to understand their schemas and relationships.
@@ -935,8 +1843,23 @@ Please provide a detailed response to a scientist posing the following query:
 """
 
 
+def _load_cli_config() -> None:
+    """Update the module config in place with command-line arguments, so every reference to it
+    sees them."""
+    cli_config = ServerConfig()  # type: ignore[call-arg]
+    for name in ServerConfig.model_fields:
+        setattr(config, name, getattr(cli_config, name))
+    logger.info("Configuration loaded: %s", config)
+
+
 def main() -> None:
-    server.run()
+    _load_cli_config()
+    if importlib.util.find_spec("uvloop") is not None:
+        # uvloop is optional: it speeds up the event loop that dispatches every tool call
+        logger.info("Running server with uvloop")
+        anyio.run(server.run_async, backend_options={"use_uvloop": True})
+    else:
+        server.run()
 
 
 if __name__ == "__main__":
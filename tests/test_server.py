@@ -9,6 +9,42 @@ def test_import_module():
         pytest.fail(f"Failed to import nwb_mcp_server.server: {e}")
 
 
+def test_main_bounds_polars_threads_before_importing_polars():
+    import os
+    import subprocess
+    import sys
+    import textwrap
+
+    env = {k: v for k, v in os.environ.items() if k != "POLARS_MAX_THREADS"}
+
+    def run(code):
+        subprocess.run([sys.executable, "-c", textwrap.dedent(code)], env=env, check=True)
+
+    # importing the package or the server module leaves the environment alone
+    run(
+        """
+        import os, sys
+        import nwb_mcp_server
+        assert "polars" not in sys.modules
+        import nwb_mcp_server.server
+        assert "POLARS_MAX_THREADS" not in os.environ
+        """
+    )
+    # main sets the default before the server module (and polars) is imported
+    run(
+        """
+        import os, sys, types
+        import nwb_mcp_server
+        server_module = types.ModuleType("nwb_mcp_server.server")
+        server_module.main = lambda: None
+        sys.modules["nwb_mcp_server.server"] = server_module
+        nwb_mcp_server.main()
+        assert os.environ["POLARS_MAX_THREADS"] == str(min(8, os.cpu_count() or 1))
+        assert "polars" not in sys.modules
+        """
+    )
+
+
 def test_cli_args(monkeypatch):
     import sys
     from nwb_mcp_server.server import ServerConfig
@@ -46,6 +82,22 @@ def test_dandi_cli_args(monkeypatch):
     assert config.glob_pattern is None
 
 
+def test_load_cli_config_updates_module_config(monkeypatch):
+    import importlib
+    import sys
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    for name in server_module.ServerConfig.model_fields:
+        # registers the current values to be restored after the test
+        monkeypatch.setattr(server_module.config, name, getattr(server_module.config, name))
+    monkeypatch.setattr(sys, 'argv', ['prog', '--root_dir', 'mydata', '--max_result_rows', '7'])
+
+    server_module._load_cli_config()
+    assert server_module.config.root_dir == 'mydata'
+    assert server_module.config.max_result_rows == 7
+    assert server_module.config.default_source_spec().root_dir == 'mydata'
+
+
 def test_dandi_defaults(monkeypatch):
     import sys
     from nwb_mcp_server.server import ServerConfig
@@ -282,5 +334,672 @@ def test_build_dataset_handle_treats_dandiset_blob_urls_as_nwb(monkeypatch):
     assert captured["kwargs"]["table_names"] == ["units"]
 
 
+def test_split_glob_separates_literal_prefix():
+    from nwb_mcp_server.server import _split_glob
+
+    assert _split_glob("**/*.nwb") == ("", "**/*.nwb")
+    assert _split_glob("sub-1/ses-*/**/*.nwb") == ("sub-1", "ses-*/**/*.nwb")
+    assert _split_glob("sub-1/file.nwb") == ("sub-1/file.nwb", "")
+    assert _split_glob("data/[ab].nwb") == ("data", "[ab].nwb")
+
+
+def test_compile_glob_matches_whole_relative_paths():
+    from nwb_mcp_server.server import _compile_glob
+
+    def matches(pattern, path):
+        return _compile_glob(pattern).fullmatch(path) is not None
+
+    assert matches("**/*.nwb", "a.nwb")
+    assert matches("**/*.nwb", "sub-1/ses-a/a.nwb")
+    assert not matches("*.nwb", "sub-1/a.nwb")
+    assert matches("**/ses-*/*.nwb", "sub-1/ses-a/a.nwb")
+    assert not matches("**/ses-*/*.nwb", "sub-1/ses-a/raw/a.nwb")
+    assert matches("sub-?/[!b]*.nwb", "sub-1/a.nwb")
+    assert not matches("sub-?/[!b]*.nwb", "sub-1/b.nwb")
+    assert matches("a+(1).nwb", "a+(1).nwb")
+
+
+def test_get_local_sources_globs_below_literal_prefix(tmp_path, monkeypatch):
+    import importlib
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+
+    root_dir = tmp_path / "data"
+    (root_dir / "sub-1" / "ses-a").mkdir(parents=True)
+    (root_dir / "sub-2").mkdir()
+    (root_dir / "sub-1" / "ses-a" / "a.nwb").touch()
+    (root_dir / "sub-2" / "b.nwb").touch()
+
+    def find(glob_pattern):
+        _, sources = server_module._get_local_or_remote_nwb_sources(
+            server_module.SourceSpec.from_local(
+                root_dir=root_dir.as_posix(), glob_pattern=glob_pattern
+            )
+        )
+        return [p.name for p in sources]
+
+    assert find("sub-1/**/*.nwb") == ["a.nwb"]
+    (root_dir / "c.nwb").touch()
+    assert find("**/*.nwb") == ["c.nwb", "a.nwb", "b.nwb"]
+    assert find("**/ses-*/*.nwb") == ["a.nwb"]
+    assert find("sub-2/b.nwb") == ["b.nwb"]
+    with pytest.raises(ValueError, match="No NWB files found"):
+        find("sub-2/c.nwb")
+
+
+def test_parallel_recursive_glob_skips_unreadable_directories(tmp_path, monkeypatch):
+    import importlib
+    import os
+
+    import upath
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    (tmp_path / "sub-1").mkdir()
+    (tmp_path / "sub-2").mkdir()
+    (tmp_path / "sub-1" / "a.nwb").touch()
+    (tmp_path / "sub-2" / "b.nwb").touch()
+    unreadable = {os.fspath(tmp_path / "sub-2")}
+    original_scandir = os.scandir
+
+    def scandir(path):
+        if os.fspath(path) in unreadable:
+            raise PermissionError(13, "Permission denied", path)
+        return original_scandir(path)
+
+    monkeypatch.setattr(server_module.os, "scandir", scandir)
+    root = upath.UPath(tmp_path)
+    sources = server_module._parallel_recursive_glob(root, "**/*.nwb")
+    assert [p.name for p in sources] == ["a.nwb"]
+    unreadable.add(os.fspath(tmp_path))
+    assert server_module._parallel_recursive_glob(root, "**/*.nwb") == []
+
+
+def test_get_remote_sources_lists_recursively_in_one_find(tmp_path, monkeypatch):
+    import importlib
+
+    import upath
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+
+    root = upath.UPath(f"memory:///{tmp_path.name}")
+    for relative_path in ("sub-1/ses-a/a.nwb", "sub-2/b.nwb", "sub-2/notes.txt", "c.nwb"):
+        (root / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (root / relative_path).write_bytes(b"")
+
+    _, sources = server_module._get_local_or_remote_nwb_sources(
+        server_module.SourceSpec.from_local(root_dir=str(root), glob_pattern="**/*.nwb")
+    )
+    assert [p.as_posix() for p in sources] == [
+        (root / relative_path).as_posix()
+        for relative_path in ("c.nwb", "sub-1/ses-a/a.nwb", "sub-2/b.nwb")
+    ]
+    assert all(p.fs is root.fs for p in sources)
+
+    _, sources = server_module._get_local_or_remote_nwb_sources(
+        server_module.SourceSpec.from_local(root_dir=str(root), glob_pattern="**/ses-*/*.nwb")
+    )
+    assert [p.name for p in sources] == ["a.nwb"]
+
+
+def test_find_concurrently_matches_sequential_find(tmp_path):
+    import fsspec
+    from fsspec.implementations.asyn_wrapper import AsyncFileSystemWrapper
+    from nwb_mcp_server.server import _find_concurrently
+
+    memory_fs = fsspec.filesystem("memory")
+    root_path = f"/{tmp_path.name}"
+    for relative_path in ("c.nwb", "sub-1/ses-a/a.nwb", "sub-2/b.nwb", "sub-2/notes.txt"):
+        memory_fs.pipe(f"{root_path}/{relative_path}", b"")
+
+    found = _find_concurrently(AsyncFileSystemWrapper(memory_fs), root_path)
+    assert sorted(found) == sorted(
+        path for path in memory_fs.find(root_path, withdirs=True) if path != root_path
+    )
+
+
+def test_get_remote_sources_matches_directory_stores(tmp_path, monkeypatch):
+    import importlib
+
+    import fsspec
+    import upath
+    from fsspec.implementations.asyn_wrapper import AsyncFileSystemWrapper
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+
+    memory_fs = fsspec.filesystem("memory")
+    root_path = f"/{tmp_path.name}"
+    for relative_path in ("a.zarr.nwb/.zattrs", "sub-1/b.zarr.nwb/acquisition/.zgroup", "c.nwb"):
+        memory_fs.pipe(f"{root_path}/{relative_path}", b"")
+
+    root = upath.UPath(f"memory://{root_path}")
+    _, sources = server_module._get_local_or_remote_nwb_sources(
+        server_module.SourceSpec.from_local(root_dir=str(root), glob_pattern="**/*.zarr.nwb")
+    )
+    assert [p.path for p in sources] == [
+        f"{root_path}/a.zarr.nwb",
+        f"{root_path}/sub-1/b.zarr.nwb",
+    ]
+
+    found = server_module._find_concurrently(AsyncFileSystemWrapper(memory_fs), root_path)
+    assert {f"{root_path}/a.zarr.nwb", f"{root_path}/sub-1/b.zarr.nwb"} <= set(found)
+
+
+def test_get_local_sources_are_searched_without_glob_cache(tmp_path, monkeypatch):
+    import importlib
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module, "GLOB_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(server_module.config, "glob_cache", True)
+
+    root_dir = tmp_path / "data"
+    (root_dir / "sub-1").mkdir(parents=True)
+    (root_dir / "a.nwb").touch()
+
+    def find(glob_pattern):
+        _, sources = server_module._get_local_or_remote_nwb_sources(
+            server_module.SourceSpec.from_local(
+                root_dir=root_dir.as_posix(), glob_pattern=glob_pattern
+            )
+        )
+        return [p.name for p in sources]
+
+    assert find("**/*.nwb") == ["a.nwb"]
+    (root_dir / "sub-1" / "b.nwb").touch()
+    assert find("**/*.nwb") == ["a.nwb", "b.nwb"]
+    assert not (tmp_path / "cache").exists()
+
+
+def test_get_remote_sources_use_glob_cache_until_root_changes(tmp_path, monkeypatch):
+    import importlib
+
+    import upath
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module, "GLOB_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(server_module.config, "glob_cache", True)
+    monkeypatch.setattr(server_module.config, "glob_cache_ttl", 3600)
+
+    root = upath.UPath(f"memory:///{tmp_path.name}")
+    (root / "a.nwb").write_bytes(b"")
+    source_spec = server_module.SourceSpec.from_local(root_dir=str(root), glob_pattern="*.nwb")
+    root_mtime = [1.0]
+    monkeypatch.setattr(server_module, "_get_search_root_mtime", lambda *args: root_mtime[0])
+    glob_calls = []
+    original_glob = server_module._glob_nwb_sources
+
+    def glob_during_write(*args):
+        glob_calls.append(args)
+        found = list(original_glob(*args))
+        if len(glob_calls) == 2:
+            # a file added while searching must not be hidden by the cache that is written next
+            (root / "c.nwb").write_bytes(b"")
+            root_mtime[0] = 3.0
+        return found
+
+    monkeypatch.setattr(server_module, "_glob_nwb_sources", glob_during_write)
+
+    def find():
+        _, sources = server_module._get_local_or_remote_nwb_sources(source_spec)
+        return [p.name for p in sources]
+
+    assert find() == ["a.nwb"]
+    assert find() == ["a.nwb"]
+    assert len(glob_calls) == 1
+
+    (root / "b.nwb").write_bytes(b"")
+    root_mtime[0] = 2.0
+    assert find() == ["a.nwb", "b.nwb"]
+    assert find() == ["a.nwb", "b.nwb", "c.nwb"]
+    assert find() == ["a.nwb", "b.nwb", "c.nwb"]
+    assert len(glob_calls) == 3
+
+
+def test_arrow_ipc_output_round_trips():
+    import base64
+    import io
+    import json
+
+    import polars as pl
+    from nwb_mcp_server.server import _to_arrow_ipc_json
+
+    df = pl.DataFrame({"id": [0, 1], "obs_intervals": [[[0.0, 1.0]], [[2.0, 3.0]]]})
+    payload = json.loads(_to_arrow_ipc_json(df))
+    assert payload["format"] == "arrow-ipc-lz4"
+    assert payload["media_type"] == "application/vnd.apache.arrow.stream"
+    restored = pl.read_ipc_stream(io.BytesIO(base64.b64decode(payload["data_b64"])))
+    assert restored.equals(df)
+
+
+def test_ndjson_output_round_trips(monkeypatch):
+    import importlib
+    import io
+
+    import polars as pl
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module, "NDJSON_BATCH_ROWS", 2)
+
+    df = pl.DataFrame({"id": [0, 1, 2], "name": ["a", "b", None]})
+    ndjson = server_module._to_ndjson(df)
+    assert len(ndjson.splitlines()) == 3
+    assert pl.read_ndjson(io.StringIO(ndjson)).equals(df)
+
+
+def test_collect_query_applies_row_limit():
+    import polars as pl
+    from nwb_mcp_server.server import _collect_query
+
+    db = pl.SQLContext(frames={"t": pl.LazyFrame({"x": range(10)})}, eager=False)
+    assert _collect_query(db, "SELECT * FROM t", row_limit=3).height == 3
+    assert _collect_query(db, "SELECT * FROM t WHERE x > 7", row_limit=3).height == 2
+    assert _collect_query(db, "SELECT * FROM t", row_limit=None).height == 10
+
+
+def test_dataset_handle_caches_table_schemas():
+    import polars as pl
+    from nwb_mcp_server.server import DatasetHandle, SourceSpec
+
+    executed = []
+
+    class CountingContext(pl.SQLContext):
+        def execute(self, query, **kwargs):
+            executed.append(query)
+            return super().execute(query, **kwargs)
+
+    db = CountingContext(frames={"units": pl.LazyFrame({"id": [1, 2]})}, eager=False)
+    dataset = DatasetHandle(source_spec=SourceSpec(), sources=[], db=db)
+    assert dataset.get_table_schema("units") == {"id": pl.Int64}
+    assert dataset.get_table_schema("units") == {"id": pl.Int64}
+    assert dataset.get_table_frame("units").collect().height == 2
+    assert len(executed) == 1
+
+    with pytest.raises(ValueError, match="Unknown table"):
+        dataset.get_table_schema('units" LIMIT 0; SELECT * FROM "units')
+    assert len(executed) == 1
+
+
+def test_table_preview_without_nwb_sources_uses_table_frame():
+    import polars as pl
+    from nwb_mcp_server.server import DatasetHandle, SourceSpec, _collect_table_preview
+
+    db = pl.SQLContext(frames={"t": pl.LazyFrame({"x": range(5), "y": range(5)})}, eager=False)
+    dataset = DatasetHandle(source_spec=SourceSpec(), sources=[], db=db, is_nwb=False)
+    df = _collect_table_preview(dataset, "t", ["y"], 2)
+    assert df.to_dict(as_series=False) == {"y": [0, 1]}
+    assert _collect_table_preview(dataset, "t", [], 0).columns == ["x", "y"]
+
+
+def test_select_schema_columns_for_schema_only_preview():
+    import polars as pl
+    from nwb_mcp_server.server import _select_schema_columns
+
+    schema = {"id": pl.Int64, "spike_times": pl.List(pl.Float64)}
+    assert _select_schema_columns(schema, []) == {
+        "id": "Int64",
+        "spike_times": "List(Float64)",
+    }
+    assert _select_schema_columns(schema, ["spike_times"]) == {"spike_times": "List(Float64)"}
+    with pytest.raises(ValueError, match="Unknown columns"):
+        _select_schema_columns(schema, ["obs_intervals"])
+
+
+@pytest.mark.parametrize(
+    "query, allowed",
+    [
+        ("SELECT * FROM units", True),
+        ("  select 1", True),
+        ("WITH t AS (SELECT 1 AS a) SELECT a FROM t", True),
+        ("(SELECT 1)", True),
+        ("-- count rows\nSELECT COUNT(*) FROM units", True),
+        ("/* comment */ SELECT 1", True),
+        ("SHOW TABLES", True),
+        ("EXPLAIN SELECT * FROM units", True),
+        ("SELECTED", False),
+        ("DROP TABLE units", False),
+        ("EXPLAIN DROP TABLE units", False),
+        ("CREATE TABLE t AS SELECT 1", False),
+        ("-- SELECT 1", False),
+        ("/* SELECT 1", False),
+    ],
+)
+def test_is_read_only_query(query, allowed):
+    from nwb_mcp_server.server import _is_read_only_query
+
+    assert _is_read_only_query(query) is allowed
+
+
+def test_is_read_only_query_is_linear_in_prefix_length():
+    import time
+
+    from nwb_mcp_server.server import _is_read_only_query
+
+    # nested quantifiers in a regex backtrack exponentially on inputs like these
+    queries = [" " * 100_000 + "x", "-- -- " * 20_000 + "x", "/**/ " * 20_000 + "x"]
+    start = time.perf_counter()
+    assert not any(_is_read_only_query(query) for query in queries)
+    assert time.perf_counter() - start < 1
+
+
+def test_format_names_escape_quotes():
+    from nwb_mcp_server.server import format_column_names, format_table_name
+
+    assert format_table_name("intervals/trials") == '"intervals/trials"'
+    assert format_table_name('a"b') == '"a""b"'
+    assert format_column_names(["id", "it's"]) == '"id", "it\'s"'
+    assert format_column_names(None) == "*"
+
+
+def test_query_coalescer_shares_in_flight_results():
+    import asyncio
+    import threading
+
+    from nwb_mcp_server.server import QueryCoalescer
+
+    calls = []
+    release = threading.Event()
+
+    def slow_query(query):
+        calls.append(query)
+        release.wait(timeout=5)
+        return query.upper()
+
+    async def main():
+        coalescer = QueryCoalescer()
+        first = asyncio.ensure_future(coalescer.run("q", slow_query, "q"))
+        second = asyncio.ensure_future(coalescer.run("q", slow_query, "q"))
+        other = asyncio.ensure_future(coalescer.run("r", slow_query, "r"))
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(first, second, other)
+        assert await coalescer.run("q", slow_query, "q") == "Q"
+        return results
+
+    assert asyncio.run(main()) == ["Q", "Q", "R"]
+    assert sorted(calls) == ["q", "q", "r"]
+
+
+def test_cast_list_of_array_columns_for_json():
+    import polars as pl
+    from nwb_mcp_server.server import _cast_list_of_array_columns
+
+    lf = pl.LazyFrame(
+        {
+            "id": [0],
+            "obs_intervals": [[[0.0, 1.0]]],
+            "images": [[[[0, 1], [2, 3]]]],
+            "waveform": [[0.0, 1.0]],
+        },
+        schema={
+            "id": pl.Int64,
+            "obs_intervals": pl.List(pl.Array(pl.Float64, 2)),
+            "images": pl.List(pl.Array(pl.Int32, (2, 2))),
+            "waveform": pl.Array(pl.Float64, 2),
+        },
+    )
+    schema = _cast_list_of_array_columns(lf).collect_schema()
+    assert schema["obs_intervals"] == pl.List(pl.List(pl.Float64))
+    assert schema["images"] == pl.List(pl.List(pl.List(pl.Int32)))
+    assert schema["waveform"] == pl.Array(pl.Float64, 2)
+    assert schema["id"] == pl.Int64
+
+
+def test_build_dataset_handle_reuses_cached_schemas(tmp_path, monkeypatch):
+    import importlib
+    import pathlib
+    import shutil
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module, "SCHEMA_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+    monkeypatch.setattr(server_module.config, "schema_cache", True)
+
+    root_dir = tmp_path / "data"
+    shutil.copytree(pathlib.Path(__file__).parent / "data", root_dir)
+    source_spec = server_module.SourceSpec.from_local(
+        root_dir=root_dir.as_posix(), glob_pattern="*.nwb"
+    )
+    query = 'SELECT id, obs_intervals FROM "units" ORDER BY _nwb_path, id'
+
+    def build():
+        return server_module._build_dataset_handle(
+            source_spec, infer_schema_length=1, table_names=None
+        )
+
+    first = build()
+    expected = first.db.execute(query).collect()
+    assert len(list((tmp_path / "cache").glob("*/manifest.json"))) == 1
+
+    def fail_get_sql_context(**kwargs):
+        raise AssertionError("Schemas should be loaded from the cache")
+
+    monkeypatch.setattr(server_module.lazynwb, "get_sql_context", fail_get_sql_context)
+    second = build()
+    assert sorted(second.db.tables()) == sorted(first.db.tables())
+    assert set(second.schema_cache) == set(second.db.tables())
+    assert second.get_table_schema("units") == first.get_table_schema("units")
+    assert second.db.execute(query).collect().equals(expected)
+
+
+def test_write_schema_cache_prunes_old_entries(tmp_path, monkeypatch):
+    import importlib
+    import os
+    import time
+
+    import polars as pl
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module, "SCHEMA_CACHE_MAX_ENTRIES", 3)
+    now = time.time()
+    # (name, age in seconds): "stale" is older than the max age
+    for name, age in [("a", 10), ("b", 20), ("c", 30), ("stale", 40 * 24 * 3600)]:
+        (tmp_path / name).mkdir()
+        manifest_path = tmp_path / name / "manifest.json"
+        manifest_path.write_text('{"tables": {}}')
+        os.utime(manifest_path, (now - age, now - age))
+
+    server_module._write_schema_cache(tmp_path / "new", {"t": {"x": pl.Int64}})
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "b", "new"]
+
+    # reading an entry marks it as recently used
+    os.utime(tmp_path / "a" / "manifest.json", (now - 100, now - 100))
+    assert server_module._read_schema_cache(tmp_path / "a") == {}
+    server_module._write_schema_cache(tmp_path / "newer", {"t": {"x": pl.Int64}})
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "new", "newer"]
+
+
+def test_preview_reads_only_the_first_source(monkeypatch):
+    import importlib
+    import pathlib
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+    monkeypatch.setattr(server_module.config, "schema_cache", False)
+
+    dataset = server_module._build_dataset_handle(
+        server_module.SourceSpec.from_local(
+            root_dir=(pathlib.Path(__file__).parent / "data").as_posix(),
+            glob_pattern="*.nwb",
+        ),
+        infer_schema_length=1,
+        table_names=None,
+    )
+    df = server_module._collect_first_source_preview(
+        dataset, "units", ["id", "obs_intervals", "_nwb_path"], 2
+    )
+    assert df.height == 2
+    assert set(df["_nwb_path"]) == {dataset.source_paths[0]}
+    assert df.schema["obs_intervals"] == server_module.pl.List(
+        server_module.pl.List(server_module.pl.Float64)
+    )
+
+
+def test_preview_table_values_accepts_one_shot_column_iterables(monkeypatch):
+    import asyncio
+    import importlib
+    import json
+    import pathlib
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    monkeypatch.setattr(server_module.config, "glob_cache", False)
+    monkeypatch.setattr(server_module.config, "schema_cache", False)
+
+    dataset = server_module._build_dataset_handle(
+        server_module.SourceSpec.from_local(
+            root_dir=(pathlib.Path(__file__).parent / "data").as_posix(),
+            glob_pattern="*.nwb",
+        ),
+        infer_schema_length=1,
+        table_names=None,
+    )
+    monkeypatch.setattr(server_module, "_get_dataset_for_request", lambda ctx: dataset)
+    first_source_previews = []
+    original_preview = server_module._collect_first_source_preview
+
+    def recording_preview(*args):
+        df = original_preview(*args)
+        first_source_previews.append(df)
+        return df
+
+    monkeypatch.setattr(server_module, "_collect_first_source_preview", recording_preview)
+
+    # pydantic validates the `columns` argument of a tool call into a one-shot iterator
+    result = asyncio.run(
+        server_module.preview_table_values(
+            "units", None, columns=iter(["id", "obs_intervals"]), n_rows=1
+        )
+    )
+    assert [list(row) for row in json.loads(result)] == [["id", "obs_intervals"]]
+    assert len(first_source_previews) == 1
+    assert first_source_previews[0].columns == ["id", "obs_intervals"]
+
+
+@pytest.fixture
+def query_dataset(monkeypatch):
+    """A non-NWB dataset with one table `t` (x = 0..4) served to the query tools, and a helper
+    that runs `_execute_query` against it."""
+    import asyncio
+    import importlib
+    import types
+
+    import polars as pl
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    db = pl.SQLContext(frames={"t": pl.LazyFrame({"x": range(5)})}, eager=False)
+    dataset = server_module.DatasetHandle(
+        source_spec=server_module.SourceSpec(), sources=[], db=db, is_nwb=False
+    )
+    app_context = types.SimpleNamespace(
+        query_coalescer=server_module.QueryCoalescer(), serialize_executor=None
+    )
+    monkeypatch.setattr(server_module, "_get_dataset_for_request", lambda ctx: dataset)
+    monkeypatch.setattr(server_module, "_get_app_context", lambda ctx: app_context)
+
+    def run(query, **kwargs):
+        return asyncio.run(server_module._execute_query(query, None, **kwargs))
+
+    return dataset, run
+
+
+def test_preview_table_values_rejects_negative_n_rows(query_dataset):
+    import asyncio
+    import importlib
+    import json
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+
+    def preview(n_rows):
+        return asyncio.run(server_module.preview_table_values("t", None, n_rows=n_rows))
+
+    assert json.loads(preview(0)) == {"x": "Int64"}
+    assert json.loads(preview(2)) == [{"x": 0}, {"x": 1}]
+    with pytest.raises(ValueError, match="cannot be negative"):
+        preview(-1)
+
+
+def test_get_nwb_paths_limit(monkeypatch):
+    import importlib
+    import types
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    dataset = types.SimpleNamespace(source_paths=("a.nwb", "b.nwb", "c.nwb"))
+    monkeypatch.setattr(server_module, "_get_dataset_for_request", lambda ctx: dataset)
+
+    assert server_module.get_nwb_paths(None) == ["a.nwb", "b.nwb", "c.nwb"]
+    assert server_module.get_nwb_paths(None, limit=2) == ["a.nwb", "b.nwb"]
+    assert server_module.get_nwb_paths(None, limit=0) == []
+    with pytest.raises(ValueError, match="cannot be negative"):
+        server_module.get_nwb_paths(None, limit=-1)
+
+
+def test_execute_query_caches_capped_results(monkeypatch, query_dataset):
+    import importlib
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    _, run = query_dataset
+    monkeypatch.setattr(server_module.config, "query_cache_size", 2)
+
+    collected = []
+    original_collect_query = server_module._collect_query
+
+    def counting_collect_query(db, query, *args):
+        collected.append(query)
+        return original_collect_query(db, query, *args)
+
+    monkeypatch.setattr(server_module, "_collect_query", counting_collect_query)
+
+    first = run("SELECT * FROM t")
+    assert run("SELECT * FROM t") == first
+    assert run("SELECT * FROM t WHERE x > 10") == "[]"
+    assert run("SELECT * FROM t WHERE x > 10") == "[]"
+    assert len(collected) == 2
+    run("SELECT * FROM t", format="ndjson")
+    run("SELECT * FROM t")  # evicted by the ndjson result
+    assert len(collected) == 4
+    run("SELECT * FROM t", allow_large_output=True)
+    run("SELECT * FROM t", allow_large_output=True)
+    assert len(collected) == 6
+
+
+def test_execute_query_caps_large_output(monkeypatch, query_dataset):
+    import importlib
+    import json
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+    _, run = query_dataset
+
+    monkeypatch.setattr(server_module.config, "max_large_output_rows", 3)
+    with pytest.raises(ValueError, match="row limit for allow_large_output"):
+        run("SELECT * FROM t", allow_large_output=True)
+    assert len(json.loads(run("SELECT * FROM t LIMIT 3", allow_large_output=True))) == 3
+    monkeypatch.setattr(server_module.config, "max_large_output_rows", 0)
+    assert len(json.loads(run("SELECT * FROM t", allow_large_output=True))) == 5
+
+
+def test_execute_queries_returns_results_and_errors_in_order(query_dataset):
+    import asyncio
+    import importlib
+    import json
+
+    server_module = importlib.import_module("nwb_mcp_server.server")
+
+    def run_batch(queries):
+        return asyncio.run(server_module._execute_queries(queries, None))
+
+    queries = [f"SELECT x FROM t WHERE x = {i}" for i in range(5)]
+    queries[2] = "SELECT y FROM t"
+    results = run_batch(queries)
+    assert results[2].startswith("Error: ")
+    assert [json.loads(r) for i, r in enumerate(results) if i != 2] == [
+        [{"x": i}] for i in (0, 1, 3, 4)
+    ]
+    with pytest.raises(ValueError, match="at least one"):
+        run_batch([])
+    too_many = ["SELECT x FROM t"] * (server_module.QUERY_BATCH_MAX_QUERIES + 1)
+    with pytest.raises(ValueError, match="exceeding the limit"):
+        run_batch(too_many)
+
 if __name__ == "__main__":
     pytest.main([__file__])